@@ -2,8 +2,8 @@
 
 __description__ = 'EML dump utility'
 __author__ = 'Didier Stevens'
-__version__ = '0.0.11'
-__date__ = '2020/11/21'
+__version__ = '0.0.12'
+__date__ = '2026/10/15'
 
 """
 
@@ -30,29 +30,71 @@ History:
   2016/04/13: 0.0.9 changed handling of obfuscating lines
   2017/07/21: 0.0.10 added filename to parts
   2020/11/21: 0.0.11 Python 3 support; updated cutting; updated yara; added selection warning
+  2026/10/15: 0.0.12 HexAsciiDump: table lookup per line in stead of per byte
+  2026/10/15: cDumpStream: join lines in stead of string concatenation
+  2026/10/15: parse the MIME file while it is read, with a feed parser
+  2026/10/15: option -s: stop parsing as soon as the selected part is complete
+  2026/10/15: added decoder method DecodeInto to decode into a buffer shared per part
+  2026/10/15: added cNumpyDecoderParent
+  2026/10/15: compile regular expressions of option -c once
+  2026/10/15: CutData returns a memoryview in stead of a copy (Python 3)
+  2026/10/15: StdoutWriteChunked: write chunks with os.write without copying the data
+  2026/10/15: HexDump: no IFF and P23Ord calls per byte
+  2026/10/15: cache compiled YARA rules (rule files and directories)
+  2026/10/15: added option --yarafast and YARA external variable filetype
+  2026/10/15: scan parts with YARA in parallel (forked processes)
+  2026/10/15: decoded data is only scanned by #s# and #x# rules if it contains their string
+  2026/10/15: YARA rules cache: identify rule files by SHA256 in stead of modification time
+  2026/10/15: walk the MIME tree once
+  2026/10/15: option -s: test once if the selection is a number
+  2026/10/15: close ZIP file and MIME file with context managers
+  2026/10/15: load decoders with importlib (Python 3)
+  2026/10/15: option -s: skip non-selected parts before any other processing
+  2026/10/15: option -c: one regular expression for cut terms; fixed search strings with Python 3
+  2026/10/15: option --yarastrings: hexadecimal string with bytes.hex (Python 3); one write per part
+  2026/10/15: import yara, numpy and zipfile only when needed
+  2026/10/15: HexAsciiDump: build the dump in a bytearray
+  2026/10/15: added option --yarasequential; no more YARA worker processes than CPUs and parts
 
 Todo:
 """
 
 import optparse
 import email
+import email.feedparser
+import email.message
 import hashlib
 import signal
 import sys
 import os
-import zipfile
+import contextlib
+import stat
+import errno
 import re
 import binascii
 import textwrap
 import string
 import math
-try:
-    import yara
-except:
-    pass
 
 MALWARE_PASSWORD = 'infected'
 
+# Optional modules are only imported when they are needed
+def ImportYARA():
+    global yara
+    try:
+        import yara
+    except:
+        return False
+    return True
+
+def ImportNumpy():
+    global numpy
+    try:
+        import numpy
+    except:
+        return False
+    return True
+
 def PrintManual():
     manual = '''
 Manual:
@@ -108,6 +150,7 @@ Option -s (select) takes an index number, but can also take a MIME type, like in
 emldump.py sample.vir -s text/plain
 
 emldump can scan the content of the parts with YARA rules (the YARA Python module must be installed). You provide the YARA rules with option -y. You can provide one file with YARA rules, an at-file (@file containing the filenames of the YARA files) or a directory. In case of a directory, all files inside the directory are read as YARA files. All parts are scanned with the provided YARA rules, you can not use option -s to select an individual part.
+YARA rules provided as files are compiled once: the compiled rules are saved in a cache directory that only your user account can write to (~/.cache/emldump or $XDG_CACHE_HOME/emldump, %LOCALAPPDATA%\\emldump on Windows) and reused as long as the content of the rule files (and the files they include) does not change.
 
 Content of example.eml:
 emldump.py example.eml
@@ -128,6 +171,11 @@ emldump.py -y contains_pe_file.yara --yarastrings example.eml
  0004e4 $a 4d5a 'MZ'
  01189f $a 4d5a 'MZ'
  
+Option --yarafast puts YARA in fast matching mode: YARA stops searching for a string as soon as it has been found once. This is faster when you only want to know which rules trigger, but option --yarastrings will then report only the first occurrence of each string.
+
+When there are several parts to scan, emldump scans them with YARA in parallel, using worker processes (one per CPU, but not more than there are parts). This is only done with Python 3.7 or later, on systems that support fork (not on Windows or macOS). Use option --yarasequential to scan the parts one after the other in the emldump process itself.
+
+The MIME type of each part is passed to the YARA rules as external variable filetype (a string), for example: condition: filetype == "application/octet-stream" and $a
 YARA rule contains_pe_file detects PE files by finding string MZ followed by string PE at the correct offset (AddressOfNewExeHeader).
 The rule looks like this:
 rule Contains_PE_File
@@ -158,6 +206,8 @@ emldump.py -y contains_pe_file.yara -D decoder_xor1,decoder_rol1,decoder_add1 ex
 
 Some decoders take options, to be provided with option --decoderoptions.
 
+Decoders that bruteforce a byte-wise encoding with a key can be derived from class cNumpyDecoderParent in stead of cDecoderParent. The encoding is then done by numpy in stead of a Python loop, and the result is written into a single buffer per part that is reused for each key. This requires the numpy Python module.
+
 Option -c (--cut) allows for the partial selection of a stream. Use this option to "cut out" part of the stream.
 The --cut option takes an argument to specify which section of bytes to select from the stream. This argument is composed of 2 terms separated by a colon (:), like this:
 termA:termB
@@ -250,17 +300,17 @@ def P23Chr(value):
     else:
         return value
 
-def File2String(filename):
-    try:
-        f = open(filename, 'rb')
-    except:
-        return None
-    try:
-        return f.read()
-    except:
-        return None
-    finally:
-        f.close()
+def FileSHA256(filename):
+    with open(filename, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+        oHash = hashlib.sha256()
+        while True:
+            data = f.read(0x100000)
+            if data == b'':
+                break
+            oHash.update(data)
+        return oHash.hexdigest()
 
 def FixPipe():
     try:
@@ -284,8 +334,92 @@ def IFF(expression, valueTrue, valueFalse):
     else:
         return CIC(valueFalse)
 
-def IsNumeric(str):
-    return re.match('^[0-9]+', str)
+# A cache directory or file is only trusted if it is not a symbolic link, is owned by the user and can not be written by others
+# Otherwise another user could plant compiled rules
+def YARACacheTrusted(path, IsType):
+    try:
+        oStat = os.lstat(path)
+    except OSError:
+        return False
+    if not IsType(oStat.st_mode):
+        return False
+    if hasattr(os, 'getuid') and oStat.st_uid != os.getuid():
+        return False
+    return oStat.st_mode & 0o022 == 0
+
+# Per-user cache directory for compiled YARA rules, created with mode 0700; None if it can not be used
+def YARACacheDirectory():
+    if sys.platform == 'win32':
+        root = os.getenv('LOCALAPPDATA')
+    else:
+        root = os.getenv('XDG_CACHE_HOME')
+        if root == None or root == '':
+            root = os.path.join(os.path.expanduser('~'), '.cache')
+    if root == None or root == '':
+        return None
+    directory = os.path.join(root, 'emldump')
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError:
+            return None
+    if not YARACacheTrusted(directory, stat.S_ISDIR):
+        return None
+    return directory
+
+YARA_RE_INCLUDE = re.compile(br'^\s*include\s+"([^"]+)"', re.M)
+
+# Adds the rule file and the files it includes (recursively) to the hash
+# Returns False if an included file can not be found: the compiled rules are then not cached
+def YARAHashRuleFile(oHash, filename, dHashed):
+    filename = os.path.abspath(filename)
+    if filename in dHashed:
+        return True
+    dHashed[filename] = True
+    if not os.path.isfile(filename):
+        return False
+    oHash.update(C2BIP3('%s|%s\n' % (filename, FileSHA256(filename))))
+    with open(filename, 'rb') as f:
+        includes = YARA_RE_INCLUDE.findall(f.read())
+    for include in includes:
+        if sys.version_info[0] > 2:
+            include = os.fsdecode(include)
+        if not os.path.isabs(include):
+            include = os.path.join(os.path.dirname(filename), include)
+        if not YARAHashRuleFile(oHash, include, dHashed):
+            return False
+    return True
+
+# Compiled rules are saved in the cache directory, and loaded in stead of compiled as long as the content of the rule files (and the files they include) does not change
+def YARACompileFilepathsCached(dFilepaths, dExternals):
+    directoryCache = YARACacheDirectory()
+    if directoryCache == None:
+        return yara.compile(filepaths=dFilepaths, externals=dExternals)
+    oHash = hashlib.sha256()
+    oHash.update(C2BIP3('%s|%s\n' % (yara.__version__, repr(sorted(dExternals.items())))))
+    dHashed = {}
+    for namespace, filename in sorted(dFilepaths.items()):
+        oHash.update(C2BIP3('%s\n' % namespace))
+        if not YARAHashRuleFile(oHash, filename, dHashed):
+            return yara.compile(filepaths=dFilepaths, externals=dExternals)
+    filenameCache = os.path.join(directoryCache, 'emldump_%s.yrc' % oHash.hexdigest())
+    if os.path.isfile(filenameCache) and YARACacheTrusted(filenameCache, stat.S_ISREG):
+        try:
+            return yara.load(filenameCache)
+        except:
+            pass
+    rules = yara.compile(filepaths=dFilepaths, externals=dExternals)
+    filenameTemp = '%s.%d' % (filenameCache, os.getpid())
+    try:
+        rules.save(filenameTemp)
+        os.chmod(filenameTemp, 0o600)
+        os.rename(filenameTemp, filenameCache)
+    except:
+        try:
+            os.remove(filenameTemp)
+        except:
+            pass
+    return rules
 
 def YARACompile(ruledata):
     if ruledata.startswith('#'):
@@ -303,7 +437,7 @@ def YARACompile(ruledata):
             rule = 'rule regex {strings: $a = /%s/ ascii wide nocase condition: $a}' % ruledata[3:]
         else:
             rule = ruledata[1:]
-        return yara.compile(source=rule, externals={'streamname': '', 'VBA': False}), rule
+        return yara.compile(source=rule, externals={'streamname': '', 'VBA': False, 'filetype': ''}), rule
     else:
         dFilepaths = {}
         if os.path.isdir(ruledata):
@@ -314,16 +448,99 @@ def YARACompile(ruledata):
         else:
             for filename in ProcessAt(ruledata):
                 dFilepaths[filename] = filename
-        return yara.compile(filepaths=dFilepaths, externals={'streamname': '', 'VBA': False}), ','.join(dFilepaths.values())
+        return YARACompileFilepathsCached(dFilepaths, {'streamname': '', 'VBA': False, 'filetype': ''}), ','.join(dFilepaths.values())
+
+# Rules generated for #s# and #x# have a single string without wildcards: data that does not contain it, does not need to be scanned by YARA
+class cYARALiteralPrefilter():
+    def __init__(self, literals, nocase):
+        self.literals = literals
+        self.nocase = nocase
+
+    def Candidate(self, data):
+        if isinstance(data, memoryview):
+            return True
+        if self.nocase:
+            data = data.lower()
+        for literal in self.literals:
+            if literal in data:
+                return True
+        return False
+
+def YARALiteralPrefilter(ruledata):
+    if ruledata.startswith('#s#'):
+        text = ruledata[3:].lower()
+        if text == '' or '\\' in text or '"' in text or [c for c in text if ord(c) < 32 or ord(c) >= 127] != []:
+            return None
+        return cYARALiteralPrefilter([C2BIP3(text), C2BIP3(''.join([c + '\x00' for c in text]))], True)
+    elif ruledata.startswith('#x#'):
+        hexstring = ''.join(ruledata[3:].split())
+        if hexstring == '' or len(hexstring) % 2 == 1 or re.match('^[0-9a-fA-F]+$', hexstring) == None:
+            return None
+        return cYARALiteralPrefilter([binascii.a2b_hex(hexstring)], False)
+    else:
+        return None
+
+def YARAMatch(rules, data, filetype, fast):
+    dExternals = {'filetype': filetype}
+    if isinstance(data, bytes):
+        return rules.match(data=data, externals=dExternals, fast=fast)
+    try:
+        return rules.match(data=data, externals=dExternals, fast=fast)
+    except TypeError:
+        # this version of yara-python does not accept a buffer
+        if isinstance(data, memoryview):
+            return rules.match(data=data.tobytes(), externals=dExternals, fast=fast)
+        else:
+            return rules.match(data=bytes(data), externals=dExternals, fast=fast)
 
 def AddDecoder(cClass):
     global decoders
 
     decoders.append(cClass)
 
+# A decoder can implement method DecodeInto(buffer) in stead of Decode():
+# it decodes into bytearray buffer, which is shared by all decoders of the same part, and returns buffer (or a memoryview of it)
 class cDecoderParent():
     pass
 
+# Parent class for decoders that transform each byte with a key, like XOR: the transformation is done by numpy in stead of a Python loop
+# A subclass implements Available, Name and Decode (calling DecodeKey) or DecodeInto (calling DecodeKeyInto), and overrides Transform for another operation than XOR
+class cNumpyDecoderParent(cDecoderParent):
+    def __init__(self, stream, options):
+        if not ImportNumpy():
+            raise Exception('This decoder requires the numpy Python module')
+        self.stream = stream
+        self.options = options
+        self.npStream = numpy.frombuffer(stream, dtype=numpy.uint8)
+        self.npOut = None
+
+    def Transform(self, key, npOut):
+        numpy.bitwise_xor(self.npStream, key, out=npOut)
+
+    def DecodeKey(self, key):
+        if self.npOut is None:
+            self.npOut = numpy.empty_like(self.npStream)
+        self.Transform(key, self.npOut)
+        return self.npOut.tobytes()
+
+    def DecodeKeyInto(self, key, buffer):
+        self.Transform(key, numpy.frombuffer(buffer, dtype=numpy.uint8))
+        return buffer
+
+# Python 3: the decoder is loaded as a module, so that its bytecode is cached (__pycache__)
+# The decoder gets the globals of emldump (cDecoderParent, AddDecoder, sys, ...), like it did with exec
+def LoadDecoder(filename):
+    if sys.version_info < (3, 5):
+        exec(open(filename, 'r').read(), globals(), globals())
+        return
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('emldump_' + os.path.splitext(os.path.basename(filename))[0], filename)
+    module = importlib.util.module_from_spec(spec)
+    for name, value in globals().items():
+        if not name.startswith('__'):
+            setattr(module, name, value)
+    spec.loader.exec_module(module)
+
 def LoadDecoders(decoders, verbose):
     if decoders == '':
         return
@@ -337,7 +554,7 @@ def LoadDecoders(decoders, verbose):
                     scriptDecoder = os.path.join(scriptPath, decoder)
                     if os.path.exists(scriptDecoder):
                         decoder = scriptDecoder
-            exec(open(decoder, 'r').read(), globals(), globals())
+            LoadDecoder(decoder)
         except Exception as e:
             print('Error loading decoder: %s' % decoder)
             if verbose:
@@ -361,6 +578,91 @@ class cIdentity(cDecoderParent):
     def Name(self):
         return ''
 
+# Returns the output lines for the part and False if scanning must stop
+def YARAScanPart(counter, oPart, rules, prefilter, options):
+    lines = []
+    data = oPart.get_payload(decode=True)
+    if data == None:
+        return lines, True
+    oDecoders = [cIdentity(data, None)]
+    for cDecoder in decoders:
+        try:
+            oDecoder = cDecoder(data, options.decoderoptions)
+            oDecoders.append(oDecoder)
+        except Exception as e:
+            if options.verbose:
+                print('Error instantiating decoder: %s' % cDecoder.name)
+                raise e
+            lines.append('Error instantiating decoder: %s' % cDecoder.name)
+            return lines, False
+    lengthString = '%7d' % len(data)
+    decodeBuffer = None
+    for oDecoder in oDecoders:
+        while oDecoder.Available():
+            if hasattr(oDecoder, 'DecodeInto'):
+                if decodeBuffer == None:
+                    decodeBuffer = bytearray(len(data))
+                decoded = oDecoder.DecodeInto(decodeBuffer)
+            else:
+                decoded = oDecoder.Decode()
+            if prefilter != None and not prefilter.Candidate(decoded):
+                continue
+            for result in YARAMatch(rules, decoded, oPart.get_content_type(), options.yarafast):
+                decoderName = oDecoder.Name()
+                if decoderName != '':
+                    decoderName = ' (%s)' % decoderName
+                lines.append('%d: %s %s %-20s %s %s%s' % (counter, IFF(oPart.is_multipart(), 'M', ' '), lengthString, oPart.get_content_type(), result.namespace, result.rule, decoderName))
+                if options.yarastrings:
+                    for stringdata in result.strings:
+                        if sys.version_info[0] > 2:
+                            hexdata = stringdata[2].hex()
+                        else:
+                            hexdata = binascii.hexlify(stringdata[2])
+                        lines.append(' %06x %s %s %s' % (stringdata[0], stringdata[1], hexdata, repr(stringdata[2])))
+    return lines, True
+
+# State of the YARA scanning worker processes, inherited via fork
+dYARAScanWorker = {}
+
+def YARAScanWorkerInitialize(parts, rules, prefilter, options):
+    dYARAScanWorker['parts'] = parts
+    dYARAScanWorker['rules'] = rules
+    dYARAScanWorker['prefilter'] = prefilter
+    dYARAScanWorker['options'] = options
+
+def YARAScanWorker(index):
+    return YARAScanPart(index + 1, dYARAScanWorker['parts'][index], dYARAScanWorker['rules'], dYARAScanWorker['prefilter'], dYARAScanWorker['options'])
+
+# Number of worker processes to scan the parts with: no more than there are CPUs or parts to scan; 1 means scan sequentially
+def YARAScanWorkers(parts, options):
+    if options.yarasequential or sys.version_info < (3, 7) or sys.platform in ['win32', 'darwin']:
+        return 1
+    import multiprocessing
+    if not 'fork' in multiprocessing.get_all_start_methods():
+        return 1
+    return min(os.cpu_count() or 1, len([oPart for oPart in parts if not oPart.is_multipart()]))
+
+# Generator yielding the result of YARAScanPart for each part, in order
+# The parts are scanned in parallel by a pool of forked processes, that inherit the parts, the rules and the decoders
+def YARAScanParts(parts, rules, prefilter, options):
+    workers = YARAScanWorkers(parts, options)
+    if workers < 2:
+        for index, oPart in enumerate(parts):
+            yield YARAScanPart(index + 1, oPart, rules, prefilter, options)
+        return
+
+    import concurrent.futures
+    import multiprocessing
+    oExecutor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'), initializer=YARAScanWorkerInitialize, initargs=(parts, rules, prefilter, options))
+    try:
+        for result in oExecutor.map(YARAScanWorker, range(len(parts))):
+            yield result
+    finally:
+        try:
+            oExecutor.shutdown(cancel_futures=True)
+        except TypeError:
+            oExecutor.shutdown()
+
 def File2Strings(filename):
     try:
         f = open(filename, 'r')
@@ -385,67 +687,81 @@ def ProcessAt(argument):
 
 class cDumpStream():
     def __init__(self):
-        self.text = ''
+        self.lines = []
 
     def Addline(self, line):
         if line != '':
-            self.text += line + '\n'
+            self.lines.append(line + '\n')
 
     def Content(self):
-        return self.text
+        return ''.join(self.lines)
 
 def HexDump(data):
     oDumpStream = cDumpStream()
     hexDump = ''
-    for i, b in enumerate(data):
+    for i, b in enumerate(bytearray(data)):
         if i % dumplinelength == 0 and hexDump != '':
             oDumpStream.Addline(hexDump)
             hexDump = ''
-        hexDump += IFF(hexDump == '', '', ' ') + '%02X' % P23Ord(b)
+        if hexDump == '':
+            hexDump = '%02X' % b
+        else:
+            hexDump += ' %02X' % b
     oDumpStream.Addline(hexDump)
     return oDumpStream.Content()
 
-def CombineHexAscii(hexDump, asciiDump):
-    if hexDump == '':
-        return ''
-    return hexDump + '  ' + (' ' * (3 * (16 - len(asciiDump)))) + asciiDump
+HEXASCIIDUMP_HEX = [C2BIP3('%02X' % iter) for iter in range(0x100)]
+HEXASCIIDUMP_ASCII = C2BIP3(''.join([IFF(iter >= 32 and iter < 127, chr(iter), '.') for iter in range(0x100)]))
 
+# Returns bytes: the dump is built in a bytearray and written to stdout without decoding
 def HexAsciiDump(data):
-    oDumpStream = cDumpStream()
-    hexDump = ''
-    asciiDump = ''
-    for i, b in enumerate(data):
-        if i % dumplinelength == 0:
-            if hexDump != '':
-                oDumpStream.Addline(CombineHexAscii(hexDump, asciiDump))
-            hexDump = '%08X:' % i
-            asciiDump = ''
-        hexDump+= ' %02X' % P23Ord(b)
-        asciiDump += IFF(P23Ord(b) >= 32 and P23Ord(b) < 127, P23Chr(b), '.')
-    oDumpStream.Addline(CombineHexAscii(hexDump, asciiDump))
-    return oDumpStream.Content()
+    output = bytearray()
+    for i in range(0, len(data), dumplinelength):
+        line = bytes(data[i:i + dumplinelength])
+        hexDump = b' '.join([HEXASCIIDUMP_HEX[b] for b in bytearray(line)])
+        output += b'%08X: %s  %s\n' % (i, hexDump.ljust(3 * dumplinelength - 1), line.translate(HEXASCIIDUMP_ASCII))
+    return bytes(output)
 
 #Fix for http://bugs.python.org/issue11395
 def StdoutWriteChunked(data):
     if sys.version_info[0] > 2:
         if isinstance(data, str):
             sys.stdout.write(data)
-        else:
+            return
+        sys.stdout.flush()
+        try:
+            fd = sys.stdout.buffer.fileno()
+        except:
             sys.stdout.buffer.write(data)
+            return
+        chunkSize = IFF(sys.platform == 'win32' and os.isatty(fd), 10000, 0x10000)
+        oMemoryview = memoryview(data)
+        position = 0
+        while position < len(oMemoryview):
+            try:
+                position += os.write(fd, oMemoryview[position:position + chunkSize])
+            except IOError as e:
+                if e.errno == errno.EPIPE:
+                    return
+                raise
     else:
-        while data != '':
-            sys.stdout.write(data[0:10000])
+        position = 0
+        while position < len(data):
+            sys.stdout.write(data[position:position + 10000])
             try:
                 sys.stdout.flush()
             except IOError:
                 return
-            data = data[10000:]
+            position += 10000
 
 CUTTERM_NOTHING = 0
 CUTTERM_POSITION = 1
 CUTTERM_FIND = 2
 CUTTERM_LENGTH = 3
 
+# Alternatives are tried from left to right: hexadecimal position, decimal position, hexadecimal search string, (unicode) search string
+CUTTERM_RE = re.compile(r"\-?0[xX](?P<hexposition>[0-9a-fA-F]+)|\-?(?P<position>\d+)|\[(?P<findhex>[0-9a-fA-F]+)\](?P<findhexinstance>\d+)?(?P<findhexoffset>[+-](?:0x[0-9a-fA-F]+|\d+))?|\[(?P<unicode>u?)\'(?P<findstring>.+?)\'\](?P<findstringinstance>\d+)?(?P<findstringoffset>[+-](?:0x[0-9a-f]+|\d+))?")
+
 def Replace(string, dReplacements):
     if string in dReplacements:
         return dReplacements[string]
@@ -467,37 +783,36 @@ def ParseInteger(argument):
 def ParseCutTerm(argument):
     if argument == '':
         return CUTTERM_NOTHING, None, ''
-    oMatch = re.match(r'\-?0x([0-9a-f]+)', argument, re.I)
+    oMatch = CUTTERM_RE.match(argument)
     if oMatch == None:
-        oMatch = re.match(r'\-?(\d+)', argument)
-    else:
-        value = int(oMatch.group(1), 16)
-        if argument.startswith('-'):
-            value = -value
-        return CUTTERM_POSITION, value, argument[len(oMatch.group(0)):]
-    if oMatch == None:
-        oMatch = re.match(r'\[([0-9a-f]+)\](\d+)?([+-](?:0x[0-9a-f]+|\d+))?', argument, re.I)
-    else:
-        value = int(oMatch.group(1))
+        return None, None, argument
+    remainder = argument[len(oMatch.group(0)):]
+    if oMatch.group('hexposition') != None or oMatch.group('position') != None:
+        if oMatch.group('hexposition') != None:
+            value = int(oMatch.group('hexposition'), 16)
+        else:
+            value = int(oMatch.group('position'))
         if argument.startswith('-'):
             value = -value
-        return CUTTERM_POSITION, value, argument[len(oMatch.group(0)):]
-    if oMatch == None:
-        oMatch = re.match(r"\[u?\'(.+?)\'\](\d+)?([+-](?:0x[0-9a-f]+|\d+))?", argument)
-    else:
-        if len(oMatch.group(1)) % 2 == 1:
+        return CUTTERM_POSITION, value, remainder
+    elif oMatch.group('findhex') != None:
+        if len(oMatch.group('findhex')) % 2 == 1:
             raise Exception("Uneven length hexadecimal string")
-        else:
-            return CUTTERM_FIND, (binascii.a2b_hex(oMatch.group(1)), int(Replace(oMatch.group(2), {None: '1'})), ParseInteger(Replace(oMatch.group(3), {None: '0'}))), argument[len(oMatch.group(0)):]
-    if oMatch == None:
-        return None, None, argument
+        searchtext = binascii.a2b_hex(oMatch.group('findhex'))
+        instance = oMatch.group('findhexinstance')
+        offset = oMatch.group('findhexoffset')
     else:
-        if argument.startswith("[u'"):
+        if oMatch.group('unicode') == 'u':
             # convert ascii to unicode 16 byte sequence
-            searchtext = oMatch.group(1).decode('unicode_escape').encode('utf16')[2:]
+            if sys.version_info[0] > 2:
+                searchtext = oMatch.group('findstring').encode('latin-1').decode('unicode_escape').encode('utf16')[2:]
+            else:
+                searchtext = oMatch.group('findstring').decode('unicode_escape').encode('utf16')[2:]
         else:
-            searchtext = oMatch.group(1)
-        return CUTTERM_FIND, (searchtext, int(Replace(oMatch.group(2), {None: '1'})), ParseInteger(Replace(oMatch.group(3), {None: '0'}))), argument[len(oMatch.group(0)):]
+            searchtext = C2BIP3(oMatch.group('findstring'))
+        instance = oMatch.group('findstringinstance')
+        offset = oMatch.group('findstringoffset')
+    return CUTTERM_FIND, (searchtext, int(Replace(instance, {None: '1'})), ParseInteger(Replace(offset, {None: '0'}))), remainder
 
 def ParseCutArgument(argument):
     type, value, remainder = ParseCutTerm(argument.strip())
@@ -556,7 +871,7 @@ def CutData(stream, cutArgument):
     elif typeLeft == CUTTERM_FIND:
         positionBegin = Find(stream, valueLeft[0], valueLeft[1])
         if positionBegin == -1:
-            return ['', None, None]
+            return [b'', None, None]
         positionBegin += valueLeft[2]
     else:
         raise Exception("Unknown value typeLeft")
@@ -572,14 +887,17 @@ def CutData(stream, cutArgument):
     elif typeRight == CUTTERM_FIND:
         positionEnd = Find(stream, valueRight[0], valueRight[1], positionBegin)
         if positionEnd == -1:
-            return ['', None, None]
+            return [b'', None, None]
         else:
             positionEnd += len(valueRight[0])
         positionEnd += valueRight[2]
     else:
         raise Exception("Unknown value typeRight")
 
-    return [stream[positionBegin:positionEnd], positionBegin, positionEnd]
+    if sys.version_info[0] > 2:
+        return [memoryview(stream)[positionBegin:positionEnd], positionBegin, positionEnd]
+    else:
+        return [stream[positionBegin:positionEnd], positionBegin, positionEnd]
 
 def ExtraInfoMD5(data):
     if data == None:
@@ -734,41 +1052,27 @@ def PrintWarningSelection(select, selectionCounter):
     if select != '' and selectionCounter == 0:
         print('Warning: no part was selected with expression %s' % select)
 
-def EMLDump(emlfilename, options):
-    FixPipe()
-    if emlfilename == '':
-        if sys.platform == 'win32':
-            import msvcrt
-            msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
-        data = sys.stdin.read()
-    elif emlfilename.lower().endswith('.zip'):
-        oZipfile = zipfile.ZipFile(emlfilename, 'r')
-        oZipContent = oZipfile.open(oZipfile.infolist()[0], 'r', C2BIP3(MALWARE_PASSWORD))
-        data = oZipContent.read()
-        oZipContent.close()
-        oZipfile.close()
-    else:
-        data = File2String(emlfilename)
-
-    data = data.decode()
-
-    global decoders
-    decoders = []
-    LoadDecoders(options.decoders, True)
+def IsEmptyLine(line):
+    return line in [b'\r\n', b'\n']
 
-    if options.yara != None:
-        if not 'yara' in sys.modules:
-            print('Error: option yara requires the YARA Python module.')
-            return
-        rules, rulesVerbose = YARACompile(options.yara)
-        if options.verbose:
-            print(rulesVerbose)
-
-    counter = 0
-    for line in data.splitlines():
-        if ContainsField(line):
+def ReadFirstLines(fEML):
+    lines = []
+    counter = None
+    while True:
+        line = fEML.readline()
+        if line == b'':
             break
-        counter += 1
+        lines.append(line)
+        if counter == None and ContainsField(line.decode('latin-1')):
+            counter = len(lines) - 1
+        if counter != None and IsEmptyLine(line):
+            break
+    if counter == None:
+        counter = len(lines)
+    return lines, counter
+
+def EMLChunks(fEML, options):
+    lines, counter = ReadFirstLines(fEML)
     if not options.header and not options.filter and options.select == '' and counter != 0:
         if counter == 1:
             print('Warning: the first line does not contain a field.')
@@ -776,108 +1080,171 @@ def EMLDump(emlfilename, options):
             print('Warning: the first %d lines do not contain a field.' % counter)
 
     if not options.filter and options.select == '':
-#        for line in data.splitlines(True):
-#            if len(line) > 100:
-#                print('Warning: contains lines longer than 100 characters.')
-#                break
-        warningPrinted = False
-        for line in data.splitlines(True):
-            if line == '\r\n':
+        for line in lines:
+            if IsEmptyLine(line):
                 break
-            if not StartsWithWhitespace(line) and not ContainsField(line) and not warningPrinted:
+            line = line.decode('latin-1')
+            if not StartsWithWhitespace(line) and not ContainsField(line):
                 print('Warning: the first block contains lines that are not a field.')
-                warningPrinted = True
+                break
 
     if options.header or options.filter:
-        data = ''.join(data.splitlines(True)[counter:])
+        lines = lines[counter:]
 
     if options.filter:
-#        data = ''.join([line for line in data.splitlines(True) if len(line) <= 100])
         temp = []
         firstBlock = True
-        for line in data.splitlines(True):
+        for line in lines:
             if not firstBlock:
                 temp.append(line)
-            if firstBlock and (StartsWithWhitespace(line) or ContainsField(line)):
+            if firstBlock and (StartsWithWhitespace(line.decode('latin-1')) or ContainsField(line.decode('latin-1'))):
                 temp.append(line)
-            if firstBlock and line == '\r\n':
+            if firstBlock and IsEmptyLine(line):
                 firstBlock = False
                 temp.append(line)
-        data = ''.join(temp)
-
-    oEML = email.message_from_string(data)
-
-    if options.select == '':
-        if options.yara == None:
-            counter = 1
-            for oPart in oEML.walk():
-                data = oPart.get_payload(decode=True)
-                if data == None:
-                    lengthString = '       '
-                else:
-                    lengthString = '%7d' % len(data)
-                extrainfo = GenerateExtraInfo(options.extra, counter, IFF(oPart.is_multipart(), 'M', ''), oPart.get_content_type(), data)
-                fieldfilename = oPart.get_filename()
-                if fieldfilename == None:
-                    fieldfilename = ''
-                else:
-                    fieldfilename = ' (' + fieldfilename + ')'
-                line = '%d: %s %s %s%s' % (counter, IFF(oPart.is_multipart(), 'M', ' '), lengthString, oPart.get_content_type(), fieldfilename)
-                if options.extra.startswith('!'):
-                    line = ''
-                line += extrainfo
-                print(line)
-                counter += 1
+        lines = temp
+
+    yield b''.join(lines)
+    while True:
+        data = fEML.read(0x10000)
+        if data == b'':
+            break
+        yield data
+
+# Python 2's FeedParser has no None default for the factory, it must only be passed when set
+def NewFeedParser(factory=None):
+    if sys.version_info[0] > 2:
+        classParser = email.feedparser.BytesFeedParser
+    else:
+        classParser = email.feedparser.FeedParser
+    if factory == None:
+        return classParser()
+    else:
+        return classParser(factory)
+
+def ParseEML(fEML, options):
+    oParser = NewFeedParser()
+    for data in EMLChunks(fEML, options):
+        oParser.feed(data)
+    return oParser.close()
+
+# Generator yielding the parts in the order of walk(), as soon as each part is parsed completely
+def IterateEMLParts(fEML, options):
+    messages = []
+
+    def MessageFactory():
+        oMessage = email.message.Message()
+        messages.append(oMessage)
+        return oMessage
+
+    oParser = NewFeedParser(MessageFactory)
+    index = 0
+    for data in EMLChunks(fEML, options):
+        oParser.feed(data)
+        # a part is complete when the parser has started the next one
+        while index < len(messages) - 1:
+            yield messages[index]
+            index += 1
+    oParser.close()
+    while index < len(messages):
+        yield messages[index]
+        index += 1
+
+# Context manager providing the MIME file as a binary file object, read directly from the ZIP file without extracting it first
+@contextlib.contextmanager
+def OpenEML(emlfilename):
+    if emlfilename == '':
+        if sys.platform == 'win32':
+            import msvcrt
+            msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+        if sys.version_info[0] > 2:
+            yield sys.stdin.buffer
         else:
-            counter = 1
-            for oPart in oEML.walk():
-                data = oPart.get_payload(decode=True)
-                if data != None:
-                    oDecoders = [cIdentity(data, None)]
-                    for cDecoder in decoders:
-                        try:
-                            oDecoder = cDecoder(data, options.decoderoptions)
-                            oDecoders.append(oDecoder)
-                        except Exception as e:
-                            print('Error instantiating decoder: %s' % cDecoder.name)
-                            if options.verbose:
-                                raise e
-                            return
-                    for oDecoder in oDecoders:
-                        while oDecoder.Available():
-                            for result in rules.match(data=oDecoder.Decode()):
-                                lengthString = '%7d' % len(data)
-                                decoderName = oDecoder.Name()
-                                if decoderName != '':
-                                    decoderName = ' (%s)' % decoderName
-                                print('%d: %s %s %-20s %s %s%s' % (counter, IFF(oPart.is_multipart(), 'M', ' '), lengthString, oPart.get_content_type(), result.namespace, result.rule, decoderName))
-                                if options.yarastrings:
-                                    for stringdata in result.strings:
-                                        print(' %06x %s %s %s' % (stringdata[0], stringdata[1], binascii.hexlify(stringdata[2]), repr(stringdata[2])))
-                counter += 1
+            yield sys.stdin
+    elif emlfilename.lower().endswith('.zip'):
+        import zipfile
+        with zipfile.ZipFile(emlfilename, 'r') as oZipfile:
+            with oZipfile.open(oZipfile.infolist()[0], 'r', C2BIP3(MALWARE_PASSWORD)) as oZipContent:
+                yield oZipContent
+    else:
+        with open(emlfilename, 'rb') as fEML:
+            yield fEML
 
+def DumpSelection(parts, options):
+    if options.dump:
+        DumpFunction = lambda x:x
+        if sys.platform == 'win32':
+            import msvcrt
+            msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+    elif options.hexdump:
+        DumpFunction = HexDump
     else:
-        if options.dump:
-            DumpFunction = lambda x:x
-            if sys.platform == 'win32':
-                import msvcrt
-                msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
-        elif options.hexdump:
-            DumpFunction = HexDump
+        DumpFunction = HexAsciiDump
+    selectIndex = None
+    if re.match('^[0-9]+$', options.select) != None:
+        selectIndex = int(options.select)
+    selectionCounter = 0
+    for counter, oPart in enumerate(parts, 1):
+        if selectIndex != None and counter != selectIndex or selectIndex == None and oPart.get_content_type() != options.select:
+            if not oPart.is_multipart():
+                oPart.set_payload(None)
+            continue
+        # the first part that matches the selection is dumped, even if other parts have the same MIME type
+        selectionCounter += 1
+        if oPart.is_multipart():
+            print('Warning: you selected a multipart stream')
         else:
-            DumpFunction = HexAsciiDump
-        counter = 1
-        selectionCounter = 0
-        for oPart in oEML.walk():
-            if IsNumeric(options.select) and counter == int(options.select) or not IsNumeric(options.select) and oPart.get_content_type() == options.select:
-                if not oPart.is_multipart():
-                    StdoutWriteChunked(DumpFunction(CutData(oPart.get_payload(decode=True), options.cut)[0]))
-                else:
-                    print('Warning: you selected a multipart stream')
-                selectionCounter += 1
-                break
-            counter += 1
-        PrintWarningSelection(options.select, selectionCounter)
+            StdoutWriteChunked(DumpFunction(CutData(oPart.get_payload(decode=True), options.cut)[0]))
+        break
+    PrintWarningSelection(options.select, selectionCounter)
+
+def EMLDump(emlfilename, options):
+    FixPipe()
+
+    global decoders
+    decoders = []
+    LoadDecoders(options.decoders, True)
+
+    if options.yara != None:
+        if not ImportYARA():
+            print('Error: option yara requires the YARA Python module.')
+            return
+        rules, rulesVerbose = YARACompile(options.yara)
+        prefilter = YARALiteralPrefilter(options.yara)
+        if options.verbose:
+            print(rulesVerbose)
+
+    with OpenEML(emlfilename) as fEML:
+        if options.select != '':
+            DumpSelection(IterateEMLParts(fEML, options), options)
+            return
+        oEML = ParseEML(fEML, options)
+
+    parts = list(oEML.walk())
+    if options.yara == None:
+        for counter, oPart in enumerate(parts, 1):
+            data = oPart.get_payload(decode=True)
+            if data == None:
+                lengthString = '       '
+            else:
+                lengthString = '%7d' % len(data)
+            extrainfo = GenerateExtraInfo(options.extra, counter, IFF(oPart.is_multipart(), 'M', ''), oPart.get_content_type(), data)
+            fieldfilename = oPart.get_filename()
+            if fieldfilename == None:
+                fieldfilename = ''
+            else:
+                fieldfilename = ' (' + fieldfilename + ')'
+            line = '%d: %s %s %s%s' % (counter, IFF(oPart.is_multipart(), 'M', ' '), lengthString, oPart.get_content_type(), fieldfilename)
+            if options.extra.startswith('!'):
+                line = ''
+            line += extrainfo
+            print(line)
+    else:
+        for lines, success in YARAScanParts(parts, rules, prefilter, options):
+            if lines != []:
+                sys.stdout.write('\n'.join(lines) + '\n')
+            if not success:
+                return
 
 def OptionsEnvironmentVariables(options):
     if options.extra == '':
@@ -893,6 +1260,8 @@ def Main():
     oParser.add_option('-s', '--select', default='', help='select item nr or MIME type for dumping')
     oParser.add_option('-y', '--yara', help="YARA rule file (or directory or @file) to check streams (YARA search doesn't work with -s option)")
     oParser.add_option('--yarastrings', action='store_true', default=False, help='Print YARA strings')
+    oParser.add_option('--yarafast', action='store_true', default=False, help='YARA fast matching mode')
+    oParser.add_option('--yarasequential', action='store_true', default=False, help='Scan the parts with YARA one after the other, in stead of in parallel')
     oParser.add_option('-D', '--decoders', type=str, default='', help='decoders to load (separate decoders with a comma , ; @file supported)')
     oParser.add_option('--decoderoptions', type=str, default='', help='options for the decoder')
     oParser.add_option('-v', '--verbose', action='store_true', default=False, help='verbose output with decoder errors')